@@ -1,55 +1,205 @@
 import os
-import json
 import time
+import hashlib
+import itertools
+import threading
 from io import BytesIO
-from functools import wraps
-from flask import Flask, request, jsonify, render_template, session, send_file
+from concurrent import futures
+from functools import wraps, lru_cache
+from operator import itemgetter
+import msgspec
+from flask import Flask, request, render_template, session
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from PIL import Image, ImageDraw, ImageFont
-from sqlalchemy import create_engine, text
+from PIL import Image, ImageDraw, ImageFont, features
+from sqlalchemy import create_engine, event, text, make_url, bindparam, JSON
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.postgresql import JSONB
 
 # ========== 配置 ==========
 DATABASE_URL = os.environ.get("DATABASE_URL")
 SECRET_KEY = os.environ.get("SECRET_KEY", "changeme_secret")
 TEACHER_PASSWORD = os.environ.get("TEACHER_PASSWORD", "changeme")
 
+try:
+    import orjson
+    json_bytes, json_loads = orjson.dumps, orjson.loads
+    # 已是 JSON 文本的值用 Fragment 原样拼入输出，无需解析再编码
+    json_fragment = orjson.Fragment
+except ImportError:
+    # 未安装 orjson 时退回标准库 json
+    import json
+    def json_bytes(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+    json_loads = json_fragment = json.loads
+
+def json_dumps(obj):
+    return json_bytes(obj).decode()
+
 if DATABASE_URL:
-    # Render 提供的 PostgreSQL 数据库
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    # Render 提供的 PostgreSQL 数据库；定期回收连接，避免被服务端回收的空闲连接报错
+    # psycopg2 的 executemany 默认逐条执行，values_plus_batch 会把批量 UPDATE 按页合并发送
+    pg_args = {"executemany_mode": "values_plus_batch"} if make_url(DATABASE_URL).get_driver_name() == "psycopg2" else {}
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True,
+                           pool_size=10, max_overflow=20, pool_recycle=1800, pool_timeout=30,
+                           json_serializer=json_dumps, json_deserializer=json_loads, **pg_args)
     print("✅ 使用 PostgreSQL 数据库")
 else:
-    # 本地 SQLite
-    engine = create_engine("sqlite:///database.db", connect_args={"check_same_thread": False})
+    # 本地 SQLite：连接池复用已打开的 database.db 连接，PRAGMA 只在新建连接时执行一次
+    engine = create_engine("sqlite:///database.db", connect_args={"check_same_thread": False},
+                           poolclass=QueuePool, pool_size=min(8, (os.cpu_count() or 1) * 2), max_overflow=10,
+                           json_serializer=json_dumps, json_deserializer=json_loads)
+
+    # WAL 模式下读写互不阻塞；synchronous=NORMAL 省去每次提交的额外 fsync
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-20000")
+        cur.close()
     print("✅ 使用本地 SQLite 数据库")
 
+# ========== 座位布局 ==========
+GROUPS = [("第一组",7),("第二组",8),("第三组",8),("第四组",7)]
+# 每排 2 个座位；分配时 copy 一份作为剩余名额
+ALL_SEATS = {f"{g}第{r}排": 2 for g, n in GROUPS for r in range(1, n + 1)}
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.config['SECRET_KEY'] = SECRET_KEY
 CORS(app, supports_credentials=True)
 
+class FastJSONProvider(DefaultJSONProvider):
+    # request.get_json()/jsonify 也走 orjson；orjson 不支持的类型交给默认实现
+    def dumps(self, obj, **kwargs):
+        try:
+            return json_dumps(obj)
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+app.json = FastJSONProvider(app)
+
+def jbytes(obj, status=200):
+    # orjson 直接输出 UTF-8 字节，省去 jsonify 的二次编码
+    return app.response_class(json_bytes(obj), status=status, mimetype="application/json")
+
 # ========== 数据库初始化 ==========
-with engine.connect() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS students (
-            id SERIAL PRIMARY KEY,
-            name TEXT,
-            score INTEGER,
-            volunteers TEXT,
-            admitted TEXT,
-            last_updated BIGINT
-        )
-    """))
-    conn.commit()
+# SQLite 中 SERIAL 不是 rowid 别名，id 会一直为 NULL，需用 INTEGER PRIMARY KEY
+ID_COLUMN = "SERIAL PRIMARY KEY" if DATABASE_URL else "INTEGER PRIMARY KEY AUTOINCREMENT"
+# PostgreSQL 用 JSONB 存志愿列表，驱动直接返回 list；SQLite 仍存 JSON 文本
+VOLUNTEERS_COLUMN = "JSONB" if DATABASE_URL else "TEXT"
+# 提交数据的合法性由约束保证，违反时 /api/submit 返回 400
+JSON_ARRAY_LENGTH = "jsonb_array_length" if DATABASE_URL else "json_array_length"
+STUDENT_CHECKS = {
+    "ck_students_name": "name <> ''",
+    "ck_students_score": "score >= 0",
+    "ck_students_volunteers": f"{JSON_ARRAY_LENGTH}(volunteers) > 0",
+}
+STUDENTS_COLUMNS = f"""
+    id {ID_COLUMN},
+    name TEXT NOT NULL CONSTRAINT ck_students_name CHECK ({STUDENT_CHECKS["ck_students_name"]}),
+    score INTEGER NOT NULL CONSTRAINT ck_students_score CHECK ({STUDENT_CHECKS["ck_students_score"]}),
+    volunteers {VOLUNTEERS_COLUMN} NOT NULL CONSTRAINT ck_students_volunteers CHECK ({STUDENT_CHECKS["ck_students_volunteers"]}),
+    admitted TEXT,
+    last_updated BIGINT
+"""
+# gunicorn 多个 worker 启动时都会执行下面的建表/迁移语句；PostgreSQL 上用事务级咨询锁串行执行，
+# 否则并发的 CREATE ... IF NOT EXISTS、ADD CONSTRAINT 可能互相冲突，导致 worker 启动失败
+SCHEMA_LOCK_ID = 0x5EA7A110C
+with engine.begin() as conn:
+    if DATABASE_URL:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": SCHEMA_LOCK_ID})
+    else:
+        # pysqlite 不会为 DDL 自动开启事务，RENAME/CREATE 会各自提交；
+        # 显式 BEGIN IMMEDIATE 让整段可整体回滚，同时先拿写锁，多个 worker 依次执行
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS students ({STUDENTS_COLUMNS})"))
+    if DATABASE_URL:
+        # 旧表的 volunteers 为 TEXT，迁移为 JSONB
+        vtype = conn.execute(text("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema=current_schema() AND table_name='students' AND column_name='volunteers'
+        """)).scalar()
+        if vtype == "text":
+            conn.execute(text("ALTER TABLE students ALTER COLUMN volunteers TYPE JSONB USING volunteers::jsonb"))
+        # 旧表补上约束；NOT VALID 只约束新写入的数据，不校验已有行
+        existing = set(conn.execute(text("SELECT conname FROM pg_constraint WHERE conrelid='students'::regclass")).scalars())
+        for cname, expr in STUDENT_CHECKS.items():
+            if cname not in existing:
+                conn.execute(text(f"ALTER TABLE students ADD CONSTRAINT {cname} CHECK ({expr}) NOT VALID"))
+        # 旧代码先查后插，并发提交可能留下同名记录，建唯一索引前只保留每人最近一次提交
+        if conn.execute(text("SELECT to_regclass('ix_students_name')")).scalar() is None:
+            conn.execute(text("""
+                DELETE FROM students a USING students b
+                WHERE a.name = b.name
+                  AND (COALESCE(a.last_updated, 0), a.id) < (COALESCE(b.last_updated, 0), b.id)
+            """))
+    else:
+        # 旧版 SQLite 表的 id 为 SERIAL，始终为 NULL，按 id 写回录取结果会落空；
+        # SQLite 不能修改列定义，只能按新结构重建表并拷回数据（不满足约束的行丢弃，同名只留最近一次提交）
+        id_type = next(r.type for r in conn.execute(text("PRAGMA table_info(students)")) if r.name == "id")
+        if id_type.upper() != "INTEGER":
+            conn.execute(text("ALTER TABLE students RENAME TO students_old"))
+            conn.execute(text(f"CREATE TABLE students ({STUDENTS_COLUMNS})"))
+            # 旧表上的索引随表改名，先删掉再在新表上建唯一索引，INSERT OR IGNORE 才能去重
+            conn.execute(text("DROP INDEX IF EXISTS ix_students_name"))
+            conn.execute(text("CREATE UNIQUE INDEX ix_students_name ON students(name)"))
+            conn.execute(text("""
+                INSERT OR IGNORE INTO students (name,score,volunteers,admitted,last_updated)
+                SELECT name,score,volunteers,admitted,last_updated FROM students_old
+                WHERE json_valid(volunteers) ORDER BY last_updated DESC
+            """))
+            conn.execute(text("DROP TABLE students_old"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_students_name ON students(name)"))
+    # 与老师端 ORDER BY 一致，按索引顺序读取即可，无需每次排序；id 保证同分同秒时顺序固定
+    # 附带 name、admitted 后，座位图查询只读索引、不回表。它以原 ix_students_rank 为前缀，故替换之
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_students_rank_id_cov ON students(score DESC, last_updated ASC, id, name, admitted)"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_students_rank"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_students_rank_cov"))
+
+# ========== SQL 语句 ==========
+# 模块级构造一次，避免每个请求重新解析 SQL 文本
+# volunteers 按 JSON 类型读写，由 SQLAlchemy/驱动负责编解码
+VOLUNTEERS_TYPE = JSON().with_variant(JSONB(), "postgresql")
+UPSERT_STUDENT = text("""
+    INSERT INTO students (name,score,volunteers,last_updated)
+    VALUES (:name,:score,:volunteers,:t)
+    ON CONFLICT (name) DO UPDATE
+    SET score=excluded.score, volunteers=excluded.volunteers, admitted=NULL, last_updated=excluded.last_updated
+""").bindparams(bindparam("volunteers", type_=VOLUNTEERS_TYPE))
+# 老师列表只是把志愿原样转发给前端，按文本取出后直接拼进响应
+SELECT_STUDENTS = text("SELECT name,score,CAST(volunteers AS TEXT),admitted FROM students ORDER BY score DESC, last_updated ASC, id")
+SELECT_FOR_ASSIGN = text("SELECT id,name,score,volunteers FROM students ORDER BY score DESC, last_updated ASC, id").columns(volunteers=VOLUNTEERS_TYPE)
+UPDATE_ADMITTED = text("UPDATE students SET admitted=:a WHERE id=:i")
+DELETE_STUDENTS = text("DELETE FROM students")
+SELECT_ASSIGNED = text("""
+    SELECT name,admitted FROM students WHERE admitted IS NOT NULL
+    ORDER BY score DESC, last_updated ASC, id
+""")
+COUNT_STUDENTS = text("SELECT COUNT(*) FROM students")
 
 # ========== 权限装饰器 ==========
+def teacher_password_from_request():
+    # 先看请求头，没有时才解析（不太大的）JSON 请求体；不接受查询参数，免得密码进入访问日志和浏览记录
+    pw = request.headers.get("X-Teacher-Password")
+    if pw is None and request.is_json and request.content_length is not None and request.content_length <= 4096:
+        pw = (request.get_json(silent=True) or {}).get("teacher_password")
+    return pw
+
 def require_teacher(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         if session.get("is_teacher"): return f(*args, **kwargs)
-        data = request.get_json(silent=True) or {}
-        if data.get("teacher_password") == TEACHER_PASSWORD:
+        if teacher_password_from_request() == TEACHER_PASSWORD:
             session["is_teacher"] = True
             return f(*args, **kwargs)
-        return jsonify({"error": "teacher authentication required"}), 401
+        return jbytes({"error": "teacher authentication required"}, 401)
     return wrapper
 
 # ========== 页面 ==========
@@ -66,65 +216,71 @@ def teacher_page():
     return render_template("teacher.html")
 
 # ========== 学生提交 ==========
+class Submission(msgspec.Struct):
+    name: str
+    # 成绩可能是数字或表单传来的字符串，统一按 int() 转换，与原先的解析规则一致
+    score: int | float | str
+    volunteers: list[str]
+
 @app.route("/api/submit", methods=["POST"])
 def submit():
-    data = request.get_json() or {}
-    name = data.get("name", "").strip()
+    # 解析与类型校验一步完成
+    # 姓名非空、成绩非负、志愿非空先在这里检查；表约束兜底，旧库的表未必带约束
     try:
-        score = int(data.get("score", -1))
-    except:
-        score = -1
-    volunteers = data.get("volunteers") or []
-    if not name or score < 0 or not isinstance(volunteers, list) or len(volunteers) == 0:
-        return jsonify({"error": "invalid data"}), 400
+        sub = msgspec.json.decode(request.get_data(), type=Submission)
+        score = int(sub.score)
+    except (msgspec.DecodeError, ValueError, OverflowError):
+        return jbytes({"error": "invalid data"}, 400)
+    name = sub.name.strip()
+    if not name or score < 0 or not sub.volunteers:
+        return jbytes({"error": "invalid data"}, 400)
 
     now = int(time.time())
-    with engine.begin() as conn:
-        res = conn.execute(text("SELECT id FROM students WHERE name=:name"), {"name": name}).fetchone()
-        if res:
-            conn.execute(text("""
-                UPDATE students
-                SET score=:score, volunteers=:volunteers, admitted=NULL, last_updated=:t
-                WHERE id=:id
-            """), {"score": score, "volunteers": json.dumps(volunteers, ensure_ascii=False), "t": now, "id": res.id})
-        else:
-            conn.execute(text("""
-                INSERT INTO students (name,score,volunteers,last_updated)
-                VALUES (:name,:score,:volunteers,:t)
-            """), {"name": name, "score": score, "volunteers": json.dumps(volunteers, ensure_ascii=False), "t": now})
-    return jsonify({"ok": True})
+    try:
+        with engine.begin() as conn:
+            # 同名学生覆盖提交，并清空上次录取结果
+            conn.execute(UPSERT_STUDENT, {"name": name, "score": score,
+                                          "volunteers": sub.volunteers, "t": now})
+    except IntegrityError:
+        return jbytes({"error": "invalid data"}, 400)
+    return jbytes({"ok": True})
 
 # ========== 老师端 ==========
 @app.route("/api/students", methods=["POST"])
 @require_teacher
 def all_students():
-    with engine.connect() as conn:
-        rows = conn.execute(text("SELECT * FROM students ORDER BY score DESC, last_updated ASC")).mappings().all()
-        data = [{"name": r["name"], "score": r["score"],
-                 "volunteers": json.loads(r["volunteers"]),
-                 "admitted": r["admitted"]} for r in rows]
-    return jsonify({"students": data})
+    def generate():
+        # 每次从游标取 500 行、编码成一块输出，内存占用不随学生人数增长
+        yield b'{"students":['
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=500).execute(SELECT_STUDENTS)
+            for i, batch in enumerate(result.partitions()):
+                chunk = b",".join(json_bytes({"name": name, "score": score,
+                                              "volunteers": json_fragment(volunteers),
+                                              "admitted": admitted})
+                                  for name, score, volunteers, admitted in batch)
+                yield b"," + chunk if i else chunk
+        yield b"]}"
+    return app.response_class(generate(), mimetype="application/json")
 
 @app.route("/api/reset", methods=["POST"])
 @require_teacher
 def reset_all():
     with engine.begin() as conn:
-        conn.execute(text("DELETE FROM students"))
-    return jsonify({"ok": True})
+        conn.execute(DELETE_STUDENTS)
+    prerender_seatmap(())
+    return jbytes({"ok": True})
 
 @app.route("/api/assign", methods=["POST"])
 @require_teacher
 def assign():
     with engine.begin() as conn:
-        rows = conn.execute(text("SELECT * FROM students ORDER BY score DESC, last_updated ASC")).mappings().all()
+        rows = conn.execute(SELECT_FOR_ASSIGN).mappings().all()
         students = [{"id": r["id"], "name": r["name"], "score": r["score"],
-                     "volunteers": json.loads(r["volunteers"])} for r in rows]
-
-        seat_quota = {}
-        for s in students:
-            for v in s["volunteers"]:
-                seat_quota.setdefault(v, 2)
+                     "volunteers": r["volunteers"]} for r in rows]
 
+        seat_quota = ALL_SEATS.copy()
+        updates, results = [], []
         for s in students:
             admitted = None
             for v in s["volunteers"]:
@@ -132,70 +288,196 @@ def assign():
                     admitted = v
                     seat_quota[v] -= 1
                     break
-            conn.execute(text("UPDATE students SET admitted=:a WHERE id=:i"), {"a": admitted, "i": s["id"]})
-    return jsonify({"ok": True})
+            updates.append({"a": admitted, "i": s["id"]})
+            results.append({"name": s["name"], "score": s["score"],
+                            "volunteers": s["volunteers"], "admitted": admitted})
+        # 一次 executemany 批量写回，而不是每个学生一条 UPDATE
+        if updates:
+            conn.execute(UPDATE_ADMITTED, updates)
+    prerender_seatmap(seatmap_state((s["name"], s["admitted"]) for s in results))
+    # students 已按名次排序，直接返回分配结果，前端无需再请求 /api/students
+    return jbytes({"ok": True, "students": results})
 
 @app.route("/api/teacher_login", methods=["POST"])
 def teacher_login():
     pw = (request.get_json() or {}).get("password")
     if pw == TEACHER_PASSWORD:
         session["is_teacher"] = True
-        return jsonify({"ok": True})
-    return jsonify({"error": "wrong password"}), 401
+        return jbytes({"ok": True})
+    return jbytes({"error": "wrong password"}, 401)
 
 # ========== 老师座位图 ==========
-@app.route("/seatmap.png")
-@require_teacher
-def seatmap():
-    with engine.connect() as conn:
-        rows = conn.execute(text("SELECT name,admitted FROM students WHERE admitted IS NOT NULL")).mappings().all()
-    assigned = {}
-    for r in rows:
-        assigned.setdefault(r["admitted"], []).append(r["name"])
-
-    groups = [("第一组",7),("第二组",8),("第三组",8),("第四组",7)]
-    width, height, padding = 1200, 600, 50
-    img = Image.new("RGB", (width, height), (245,250,255))
-    draw = ImageDraw.Draw(img)
+MAP_WIDTH, MAP_HEIGHT, MAP_PADDING = 1200, 600, 50
+GROUP_WIDTH = (MAP_WIDTH - MAP_PADDING*2) / len(GROUPS)
 
-    font_path = os.path.join(app.static_folder, "fonts", "楷体_GB2312.ttf")
-    if os.path.exists(font_path):
-        font_title = ImageFont.truetype(font_path, 20)
-        font_seat = ImageFont.truetype(font_path, 14)
-    else:
-        font_title = ImageFont.load_default()
-        font_seat = ImageFont.load_default()
+# 字体只需在启动时解析一次
+FONT_PATH = os.path.join(app.static_folder, "fonts", "楷体_GB2312.ttf")
+try:
+    FONT_TITLE = ImageFont.truetype(FONT_PATH, 20)
+    FONT_SEAT = ImageFont.truetype(FONT_PATH, 14)
+except OSError:
+    FONT_TITLE = FONT_SEAT = ImageFont.load_default()
 
-    group_width = (width - padding*2) / len(groups)
-    for gi, (gname, rows) in enumerate(groups):
-        gx = padding + gi * group_width
-        draw.text((gx + 40, padding - 25), gname, fill=(30,111,186), font=font_title)
+def build_seat_boxes():
+    # 座位名 -> (排号, 矩形坐标)，只取决于固定布局
+    boxes = {}
+    for gi, (gname, rows) in enumerate(GROUPS):
+        gx = int(MAP_PADDING + gi * GROUP_WIDTH)
         for r in range(1, rows + 1):
-            seat_name = f"{gname}第{r}排"
-            bx1, by1 = gx, padding + (r - 1) * 30
-            bx2, by2 = bx1 + group_width - 20, by1 + 24
-            names = assigned.get(seat_name, [])
-            fill = (255,255,255)
-            if len(names)==1: fill=(255,230,150)
-            if len(names)==2: fill=(120,200,120)
-            draw.rectangle([(bx1,by1),(bx2,by2)], fill=fill, outline=(180,180,180))
-            draw.text((bx1+5, by1+4), f"{r}排 ({len(names)}/2)", fill=(0,0,0), font=font_seat)
-            if names:
-                draw.text((bx1+80, by1+4), "、".join(names), fill=(40,40,40), font=font_seat)
+            by1 = MAP_PADDING + (r - 1) * 30
+            boxes[f"{gname}第{r}排"] = (r, (gx, by1, gx + int(GROUP_WIDTH) - 20, by1 + 24))
+    return boxes
 
+SEAT_BOXES = build_seat_boxes()
+
+# 按已录取人数（0/1/2）取座位底色
+SEAT_FILLS = ((255,255,255), (255,230,150), (120,200,120))
+
+def draw_seat(img, draw, r, box, names):
+    bx1, by1, bx2, by2 = box
+    fill = SEAT_FILLS[min(len(names), 2)]
+    # 纯色矩形直接用 paste 填充（C 层整块写入），先铺边框色再填内部
+    img.paste((180,180,180), (bx1, by1, bx2 + 1, by2 + 1))
+    img.paste(fill, (bx1 + 1, by1 + 1, bx2, by2))
+    draw.text((bx1+5, by1+4), f"{r}排 ({len(names)}/2)", fill=(0,0,0), font=FONT_SEAT)
+    if names:
+        draw.text((bx1+80, by1+4), "、".join(names), fill=(40,40,40), font=FONT_SEAT)
+
+def build_base_img():
+    # 背景、组标题和空座位不随录取结果变化，预先画好，每次请求 copy 一份
+    img = Image.new("RGB", (MAP_WIDTH, MAP_HEIGHT), (245,250,255))
+    draw = ImageDraw.Draw(img)
+    for gi, (gname, _) in enumerate(GROUPS):
+        draw.text((MAP_PADDING + gi * GROUP_WIDTH + 40, MAP_PADDING - 25), gname, fill=(30,111,186), font=FONT_TITLE)
+    for r, box in SEAT_BOXES.values():
+        draw_seat(img, draw, r, box, ())
+    return img
+
+BASE_IMG = build_base_img()
+
+# 输出格式：格式名 -> (Pillow 格式, MIME 类型, 编码参数)
+# 无损 WebP 在 method=1、quality=0 时编码耗时与低压缩 PNG 相当，体积约为其 1/5；
+# 浏览器声明支持 image/webp 时优先使用，否则退回 PNG（大面积纯色，低压缩级别即可）
+SEATMAP_FORMATS = {
+    "png": ("PNG", "image/png", {"compress_level": 1}),
+    "webp": ("WEBP", "image/webp", {"lossless": True, "method": 1, "quality": 0}),
+}
+WEBP_SUPPORTED = features.check("webp")
+
+@lru_cache(maxsize=8)
+def render_seatmap(state, fmt="png"):
+    # state 为 ((座位, (姓名, ...)), ...)；只需重画有人录取的座位
+    # 以录取结果本身为键缓存，清空/重新分配回到之前的结果时直接复用
+    img = BASE_IMG.copy()
+    draw = ImageDraw.Draw(img)
+    for seat_name, names in state:
+        if seat_name in SEAT_BOXES:
+            r, box = SEAT_BOXES[seat_name]
+            draw_seat(img, draw, r, box, names)
+
+    pil_format, _, options = SEATMAP_FORMATS[fmt]
     buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    img.save(buf, format=pil_format, **options)
+    return buf.getvalue()
+
+# 渲染在线程池中进行：同一版本只渲染一次，并发请求共享同一个 future；
+# 新版本渲染超过 RENDER_WAIT 秒时，先返回同一格式上一版本的图片
+RENDER_EXECUTOR = futures.ThreadPoolExecutor(max_workers=2)
+RENDER_WAIT = 2
+_render_lock = threading.Lock()
+_render_seq = itertools.count()
+_last_render = {}  # 格式 -> (seq, etag, 图片字节)
+_pending_renders = {}
+
+def _render_job(seq, etag, state, fmt):
+    try:
+        data = render_seatmap(state, fmt)
+        with _render_lock:
+            if seq > _last_render.get(fmt, (-1,))[0]:
+                _last_render[fmt] = (seq, etag, data)
+        return data
+    finally:
+        with _render_lock:
+            _pending_renders.pop(etag, None)
+
+def _schedule_render(etag, state, fmt):
+    # 调用方需持有 _render_lock
+    future = _pending_renders.get(etag)
+    if future is None:
+        future = _pending_renders[etag] = RENDER_EXECUTOR.submit(_render_job, next(_render_seq), etag, state, fmt)
+    return future
+
+def seatmap_state(rows):
+    # rows 为按名次排列的 (姓名, 录取座位)；按座位稳定排序后分组，同一座位内仍保持名次顺序
+    rows = sorted((r for r in rows if r[1] is not None), key=itemgetter(1))
+    return tuple((seat, tuple(name for name, _ in grp)) for seat, grp in itertools.groupby(rows, key=itemgetter(1)))
+
+def seatmap_etag(state, fmt):
+    return hashlib.blake2b(json_bytes(state), digest_size=16).hexdigest() + "-" + fmt
+
+def seatmap_format(accepts_webp=True):
+    # /seatmap 与预渲染共用同一选择规则；老师页面请求时声明了 image/webp
+    return "webp" if WEBP_SUPPORTED and accepts_webp else "png"
+
+def prerender_seatmap(state):
+    # 分配/清空后立即在后台渲染老师页面将请求的格式，打开座位图时直接命中，不必等待
+    fmt = seatmap_format()
+    etag = seatmap_etag(state, fmt)
+    with _render_lock:
+        if _last_render.get(fmt, (-1, None))[1] != etag:
+            _schedule_render(etag, state, fmt)
+
+def get_seatmap(etag, state, fmt):
+    with _render_lock:
+        _, stale_etag, stale_data = _last_render.get(fmt, (-1, None, None))
+        if stale_etag == etag:
+            return etag, stale_data
+        future = _schedule_render(etag, state, fmt)
+    if stale_data is None:
+        return etag, future.result()
+    try:
+        return etag, future.result(timeout=RENDER_WAIT)
+    except futures.TimeoutError:
+        return stale_etag, stale_data
+
+def seatmap_response(fmt):
+    with engine.connect() as conn:
+        state = seatmap_state(conn.execute(SELECT_ASSIGNED))
+
+    # 录取结果未变时返回 304，浏览器直接使用缓存
+    etag = seatmap_etag(state, fmt)
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        etag, data = get_seatmap(etag, state, fmt)
+        resp = app.response_class(data, mimetype=SEATMAP_FORMATS[fmt][1])
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+    return resp
+
+@app.route("/seatmap")
+@require_teacher
+def seatmap():
+    # 老师页面使用：按 Accept 协商，支持时返回 WebP
+    resp = seatmap_response(seatmap_format("image/webp" in request.accept_mimetypes.values()))
+    resp.vary.add("Accept")
+    return resp
+
+@app.route("/seatmap.png")
+@require_teacher
+def seatmap_png():
+    # 扩展名固定为 .png，始终返回 PNG，另存为时文件类型与扩展名一致
+    return seatmap_response("png")
 
 @app.route("/dbtest")
 def dbtest():
     with engine.connect() as conn:
-        total = conn.execute(text("SELECT COUNT(*) FROM students")).scalar()
+        total = conn.execute(COUNT_STUDENTS).scalar()
     db_type = "PostgreSQL" if DATABASE_URL else "SQLite"
     return f"✅ 数据库连接成功：{db_type}<br>当前学生数：{total}"
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # 仅用于本地开发；生产环境通过 gunicorn 加载 wsgi.py
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
 
 